@@ -2,52 +2,76 @@
 
 # Load modules
 import datetime
+import os
 import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from biogeme.expressions import Expression
-from choicedesign.criteria import _derr
+from choicedesign.criteria import _build_models, _imat, _logdet
+
+# Utility functions of the restarts in progress, inherited by the worker processes
+_restart_V = None
 
 # Swapping algorithm function
 def _swapalg(
     design: pd.DataFrame, model: Expression,draws: int,
-    init_perf: float, cond: list, fixed: list,
-    iter_lim: float, noimprov_lim: float,time_lim: float):
+    init_perf: float, cond: list, candidate_swaps: list,
+    iter_lim: float, noimprov_lim: float,time_lim: float,
+    rng: np.random.Generator, batch_size: int = 1, progress: bool = True):
     """Random swapping algorithm
 
     It optimises an experimental design using a variation of the random swapping 
-    algorithm [1].
+    algorithm [1]. In each iteration, `batch_size` random swaps of the same 
+    attribute are evaluated together, and the one that reduces the D-error 
+    the most is kept.
+
+    The information matrix is stored as the sum of the contributions of each 
+    choice situation, so each swap only re-evaluates the two choice situations 
+    involved. The log-determinants of the updated information matrices of a 
+    batch are computed with a single stacked factorisation. Random attributes 
+    and swaps are pre-sampled in blocks from `rng`.
 
     References
     ----------
     [1] Quan, W., Rose, J. M., Collins, A. T., & Bliemer, M. C. (2011). A comparison 
     of algorithms for generating efficient choice experiments.
     """
-    # Lock design matrix and names
+    # Lock design matrix and names (swaps are done in place, so the design matrix is copied once)
     names = design.columns
-    desmat = design.to_numpy()
+    desmat = design.to_numpy(copy=True)
 
     # Start stopwatch
-    t0 = time.time()
-    t1 = time.time()
+    t0 = time.monotonic()
+    t1 = t0
 
     difftime = 0
+    lastprint = -1
+
+    # Pre-sample random attributes and random numbers for the swaps, in blocks that are refilled when exhausted
+    block_size = max(4096,batch_size)
+    att_block = rng.integers(design.shape[1],size=block_size)
+    att_pos = 0
+    u_block = rng.random((block_size,2))
+    u_pos = 0
 
     # Initialize algorithm parameters
-    i = np.random.choice(np.arange(design.shape[1]))
+    i = att_block[att_pos]
+    att_pos = att_pos + 1
     t = 0
     ni = 0
     iterperf = init_perf
-    newperf = init_perf
 
-    # Initialize candidate swaps list
-    candidate_swaps = []
-    
-    for k in range(desmat.shape[1]):
-        if fixed[k] is None:
-            candidate_swaps.append(range(len(desmat)))
-        else:
-            candidate_swaps.append(fixed[k])
+    # Initialize the contribution of each choice situation to the information matrix, and its log-determinant
+    im_cs = _imat(design,model,draws,aggregation=False)
+    im = im_cs.sum(axis=0)
+    log_det = _logdet(im)
+    n_pars = im_cs.shape[1]
+
+    # Compile conditions once (if defined), so they are not parsed on each iteration
+    if cond is not None:
+        cond = [compile(c,'<cond>','eval') for c in cond]
 
     # Start algorithm
     while True:
@@ -59,58 +83,154 @@ def _swapalg(
         if ni >= noimprov_lim or t >= iter_lim or (difftime)/60 >= time_lim:
             break
         
-        # Take a random swap
-        pairswap = np.random.choice(candidate_swaps[i],2,replace=False)
-        
-        # Check if attribute levels differ
-        check_difflevels = desmat[pairswap[0],i] != desmat[pairswap[1],i]
-
-        # If attribute levels differ, do the swap and check for conditions (if defined)
-        if check_difflevels:
-            swapdes = desmat.copy()
-            swapdes[pairswap[0],i] = desmat[pairswap[1],i]
-            swapdes[pairswap[1],i] = desmat[pairswap[0],i]
-        
-            # Check if conditions are satisfied after a swap
-            check_all = [True]
+        # Take a batch of random swaps (two different candidate rows each), and keep those where attribute levels differ and conditions are satisfied
+        if u_pos + batch_size > block_size:
+            u_block = rng.random((block_size,2))
+            u_pos = 0
+
+        u = u_block[u_pos:u_pos+batch_size]
+        u_pos = u_pos + batch_size
+
+        n_rows = len(candidate_swaps[i])
+        row_a = (u[:,0]*n_rows).astype(int)
+        row_b = (u[:,1]*(n_rows-1)).astype(int)
+        row_b = row_b + (row_b >= row_a)
+
+        pairswaps = []
+
+        for pairswap in candidate_swaps[i][np.c_[row_a,row_b]]:
+            # Check if attribute levels differ
+            if desmat[pairswap[0],i] == desmat[pairswap[1],i]:
+                continue
+
+            # Do the swap in place and check for conditions (if defined)
+            desmat[pairswap[0],i], desmat[pairswap[1],i] = desmat[pairswap[1],i], desmat[pairswap[0],i]
+
+            check_all = True
             
-            # If conditions are defined, this section will check that are satisfied, and rewrite 'check_satisfied_conds' if neccesary
+            # If conditions are defined, this section will check that are satisfied, stopping at the first one that fails
             if cond is not None:
                 for c in cond:
-                    check_all.append(np.all(eval(c)))
+                    if not np.all(eval(c)):
+                        check_all = False
+                        break
+
+            # Revert the swap
+            desmat[pairswap[0],i], desmat[pairswap[1],i] = desmat[pairswap[1],i], desmat[pairswap[0],i]
 
-                check_all = np.all(check_all)
-            
-            # If all conditions are satisfied, compute D-error
             if check_all:
-                newperf = _derr(pd.DataFrame(swapdes,columns=names),model,draws)
+                pairswaps.append(pairswap)
 
-        # ...else if they do not differ, keep the D-error
-        else:
-            newperf = iterperf.copy()
-            
-        # If the swap made an improvement, keep the design and update progress bar
-        improved = newperf < iterperf
+        # Find the swap that reduces the D-error the most, if any
+        best = None
+
+        if len(pairswaps) > 0:
+            # Evaluate the swapped choice situations of all swaps with a single call
+            pairswaps = np.array(pairswaps)
+            swaprows = desmat[pairswaps.ravel()]
+            swaprows[:,i] = desmat[pairswaps[:,::-1].ravel(),i]
+
+            newim_cs = _imat(pd.DataFrame(swaprows,columns=names),model,draws,aggregation=False)
+            newim_cs = newim_cs.reshape((len(pairswaps),2,n_pars,n_pars))
+            delta = newim_cs.sum(axis=1) - im_cs[pairswaps].sum(axis=1)
 
-        if improved:
-            desmat = swapdes.copy()
-            iterperf = newperf.copy()
+            # Only a swap that increases the determinant of the information matrix reduces the D-error
+            newlog_det = _logdet(im + delta)
+            c = np.argmax(newlog_det)
+
+            if newlog_det[c] > log_det:
+                best = c
+
+        # If a swap made an improvement, keep the design
+        if best is not None:
+            pairswap = pairswaps[best]
+            desmat[pairswap[0],i], desmat[pairswap[1],i] = desmat[pairswap[1],i], desmat[pairswap[0],i]
+            im_cs[pairswap] = newim_cs[best]
+
+            # Sum the contributions again, so rounding errors do not accumulate
+            im = im_cs.sum(axis=0)
+            log_det = newlog_det[best]
+
+            iterperf = np.exp(-log_det/n_pars)
             ni = 0
-            
-            # Update progress bar
-            print('Optimizing / ' + 'Elapsed: ' + str(datetime.timedelta(seconds=difftime))[:7] + ' / D-error: ' + str(round(iterperf,6)),end='\r')
         
         # ...else, pass to a random attribute and increment the 'no improvement' counter by 1.
         else:
-            i = np.random.choice(np.arange(design.shape[1]))
+            if att_pos == block_size:
+                att_block = rng.integers(design.shape[1],size=block_size)
+                att_pos = 0
+
+            i = att_block[att_pos]
+            att_pos = att_pos + 1
             ni = ni+1
         
-        # Update progress bar each second
-        if (difftime)%1 < 0.1:
+        # Update progress bar at most once per second
+        if progress and difftime - lastprint >= 1:
             print('Optimizing / ' + 'Elapsed: ' + str(datetime.timedelta(seconds=difftime))[:7] + ' / D-error: ' + str(round(iterperf,6)),end='\r',flush=True)
+            lastprint = difftime
         
-        t1 = time.time()
+        t1 = time.monotonic()
         difftime = t1-t0
     
+    # Show the final state of the progress bar
+    if progress:
+        print('Optimizing / ' + 'Elapsed: ' + str(datetime.timedelta(seconds=difftime))[:7] + ' / D-error: ' + str(round(iterperf,6)),end='\r',flush=True)
+
     # Return optimal design plus efficiency
-    return pd.DataFrame(desmat,columns=names), iterperf, t, difftime
\ No newline at end of file
+    return pd.DataFrame(desmat,columns=names), iterperf, t, difftime
+
+# Single restart of the swapping algorithm in a worker process
+def _swapalg_worker(
+    seed: np.random.SeedSequence, design: pd.DataFrame, model: str,
+    draws: int, init_perf: float, cond: list, candidate_swaps: list,
+    iter_lim: float, noimprov_lim: float, time_lim: float, batch_size: int):
+    """Random swapping algorithm with its own random streams
+
+    Biogeme expressions cannot be pickled, so the model is built again from 
+    the utility functions of the restarts in progress (`_restart_V`), which 
+    the worker process inherits from its parent. It seeds the global NumPy 
+    random state (used by Biogeme for the draws) and the generator of 
+    `_swapalg` from `seed`, so results do not depend on the worker that 
+    runs the restart."""
+    model_object, _ = _build_models(_restart_V,model)
+    np.random.seed(seed.generate_state(1)[0])
+
+    return _swapalg(
+        design,model_object,draws,init_perf,cond,candidate_swaps,iter_lim,noimprov_lim,time_lim,
+        rng=np.random.default_rng(seed),batch_size=batch_size,progress=False)
+
+# Parallel restarts of the swapping algorithm
+def _swapalg_restarts(
+    design: pd.DataFrame, V: dict, model: str, draws: int,
+    init_perf: float, cond: list, candidate_swaps: list,
+    iter_lim: float, noimprov_lim: float,time_lim: float,
+    seeds: list, batch_size: int = 1, n_workers: int = None):
+    """Independent restarts of the random swapping algorithm
+
+    It runs `_swapalg` once for each seed sequence in `seeds`, in a pool of 
+    `n_workers` forked processes, and returns the result with the lowest 
+    D-error. Where processes cannot be forked, the restarts run one after 
+    another in the current process.
+    """
+    global _restart_V
+
+    if n_workers is None:
+        n_workers = min(len(seeds),os.cpu_count())
+
+    args = (design,model,draws,init_perf,cond,candidate_swaps,iter_lim,noimprov_lim,time_lim,batch_size)
+
+    # The utility functions are set before the pool starts, so the forked workers inherit them
+    _restart_V = V
+
+    try:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            with ProcessPoolExecutor(max_workers=n_workers,mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = [executor.submit(_swapalg_worker,seed,*args) for seed in seeds]
+                results = [f.result() for f in futures]
+        else:
+            results = [_swapalg_worker(seed,*args) for seed in seeds]
+    finally:
+        _restart_V = None
+
+    # Return the restart with the lowest D-error
+    return min(results,key=lambda r: r[1])
\ No newline at end of file
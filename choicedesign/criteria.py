@@ -3,45 +3,80 @@
 # Import modules
 import numpy as np
 import pandas as pd
-from biogeme.expressions import Expression
+from biogeme.expressions import Expression, MonteCarlo, log
 from biogeme.database import Database
-from choicedesign.utils import _dummygen
+from biogeme.models import loglogit, logit
+
+# Model objects function
+def _build_models(V: dict, model: str):
+    """Model objects of the D-error and utility balance criteria
+
+    It returns the log-likelihood expression of the first alternative and 
+    the list of choice probability expressions of each alternative."""
+    # All alternatives are available
+    av = {k: 1 for k in V}
+
+    if model == 'mnl':
+        model_object = loglogit(V,av,1)
+        models_ubalance = [logit(V,av,k) for k in V]
+    elif model == 'mnl_bayesian':
+        model_object = log(MonteCarlo(logit(V,av,1)))
+        models_ubalance = [MonteCarlo(logit(V,av,k)) for k in V]
+    else:
+        raise ValueError("""Model name must be either 'mnl' or 'mnl_bayesian'""")
 
-# D-error function
-def _derr(design: pd.DataFrame, model: Expression,ndraws):
-    """D-error of an information matrix"""
-    # Get information matrix
-    _, _, im, _ = model.getValueAndDerivatives(database=Database('design',design),numberOfDraws=ndraws,aggregation=True,prepareIds=True,bhhh=False)
+    return model_object, models_ubalance
 
-    # Calculate D-error
-    # if np.linalg.det(im) != 0:
-    if not np.isclose(np.linalg.det(im), 0):
-        vce = np.linalg.solve(im,np.eye(im.shape[0]))
+# Information matrix function
+def _imat(design: pd.DataFrame, model: Expression, ndraws, aggregation: bool = True):
+    """Information matrix of a design
 
-        # if asc is not None:
-        #     vce = vce[len(asc):,len(asc):]
+    If `aggregation` is False, the contribution of each choice situation is 
+    returned instead, as an array of shape (n_rows, n_pars, n_pars)."""
+    _, _, h, _ = model.getValueAndDerivatives(database=Database('design',design),numberOfDraws=ndraws,aggregation=aggregation,prepareIds=True,bhhh=False)
 
-        detvce = np.linalg.det(vce)
+    # The information matrix is the negative of the Hessian of the log-likelihood
+    return -np.array(h)
 
-        if detvce > 0:
-            dr = detvce**(1/vce.shape[0])
-        else:
-            dr = np.inf
-    else:
-        dr = np.inf
+# Log-determinant of information matrices
+def _logdet(im: np.ndarray):
+    """Log-determinant of an information matrix, or of a stack of them
+
+    It is -inf where the determinant is not positive. Matrices that are not 
+    positive definite but have a positive determinant (as the simulated 
+    information matrix of Bayesian designs can be) keep a finite value."""
+    # Take the Cholesky factor if all matrices are positive definite...
+    try:
+        L = np.linalg.cholesky(im)
+        return 2*np.log(np.diagonal(L,axis1=-2,axis2=-1)).sum(axis=-1)
+
+    # ...else, fall back to the sign and log of the absolute determinant
+    except np.linalg.LinAlgError:
+        sign, log_det = np.linalg.slogdet(im)
+        return np.where(sign > 0,log_det,-np.inf)
+
+# D-error of an information matrix
+def _derr_imat(im: np.ndarray):
+    """D-error of an information matrix"""
+    # Calculate D-error from the log-determinant, without inverting the information matrix
+    dr = np.exp(-_logdet(im)/im.shape[0])
 
     return dr
 
+# D-error function
+def _derr(design: pd.DataFrame, model: Expression,ndraws):
+    """D-error of a design"""
+    # Get information matrix
+    im = _imat(design,model,ndraws)
+
+    return _derr_imat(im)
+
 # Utility balance
 def _utility_balance(design: pd.DataFrame, model: list,ndraws):
     """Utility balance ratio"""
-    # Calculate choice probabilities
-    p = []
-
-    for j in range(len(model)):
-        p.append(model[j].getValueAndDerivatives(database=Database('design',design),numberOfDraws=ndraws,aggregation=False,prepareIds=True,bhhh=False)[0])
-
-    p = np.array(p)
+    # Calculate choice probabilities, sharing the same database across alternatives
+    database = Database('design',design)
+    p = np.array([m.getValueAndDerivatives(database=database,numberOfDraws=ndraws,aggregation=False,prepareIds=True,bhhh=False)[0] for m in model])
 
     # Calculate utility balance ratio
     B = p/(1/len(p))
@@ -1,16 +1,12 @@
 """Modules to construct efficient designs"""
 
 # Import modules
-from re import L
-from unicodedata import name
 import pandas as pd
 import numpy as np
 import datetime
-from biogeme.expressions import Expression, MonteCarlo, log
-from biogeme.models import loglogit, logit
 
-from choicedesign.algorithms import _swapalg
-from choicedesign.criteria import _derr, _utility_balance
+from choicedesign.algorithms import _swapalg, _swapalg_restarts
+from choicedesign.criteria import _build_models, _derr, _utility_balance
 from choicedesign.utils import _blockgen, _condgen, _initdesign
 
 # Efficient design
@@ -46,22 +42,17 @@ class EffDesign:
         self.J = len(alts)
         self.K = len(atts_list)
  
-        # Set names and levels
-        self.names = []
-        self.levs = []
-        self.fixed = []
+        # Set names, levels and fixed rows of the attributes available in each alternative
+        avail = [frozenset(k['avail']) for k in atts_list]
+        atts = [(j + '_' + k['name'],k['levels'],k['fixed']) for j in alts for k, a in zip(atts_list,avail) if j in a]
 
-        for j in alts:
-            for k in atts_list:
-                if j in k['avail']:
-                    self.names.append(j + '_' + k['name'])
-                    self.levs.append(k['levels'])
+        self.names, self.levs, self.fixed = (list(x) for x in zip(*atts))
 
-                # Set fixed rows
-                self.fixed.append(k['fixed'])
+        # Set candidate rows for swaps of each attribute
+        self.candidate_swaps = [np.arange(ncs) if f is None else np.asarray(f) for f in self.fixed]
 
     # Generate initial design matrix
-    def gen_initdesign(self,cond: list = None, seed: bool = None):
+    def gen_initdesign(self,cond: list = None, seed: int = None):
         """Generate initial design matrix
 
         It generates the initial design matrix. The user can define a set of
@@ -77,7 +68,7 @@ class EffDesign:
             relations (e.g., `if X > a then Y < b` where `a` and `b` are values).
             Users can specify multiple conditions when the operator `if` is defined, 
             separated by the operator `&`, by default None
-        seed : bool, None
+        seed : int, optional
             Random seed, by default None
 
         Returns
@@ -88,26 +79,24 @@ class EffDesign:
 
         # Generate conditions if defined
         if cond is not None:
-            self.initconds = _condgen('desmat',cond,self.names,init=True)
-            self.algconds = _condgen('swapdes',cond,self.names,init=False)
+            self.algconds = _condgen('desmat',cond,self.names)
         else:
-            self.initconds = None
             self.algconds = None
 
-        # Set random seed if defined
-        if seed is not None:
-            np.random.seed(seed)
+        # Set random generator
+        rng = np.random.default_rng(seed)
 
         # Generate initial design matrix
-        init_design = _initdesign(levs=self.levs,ncs=self.N,cond=self.initconds)
+        init_design = _initdesign(levs=self.levs,ncs=self.N,cond=self.algconds,rng=rng)
 
         for k in range(len(self.fixed)):
-            init_design[self.fixed[k],k] = 0
+            if self.fixed[k] is not None:
+                init_design[self.fixed[k],k] = 0
 
         return pd.DataFrame(init_design,columns=self.names)
 
     # Optimise
-    def optimise(self, init_design: pd.DataFrame, V: dict, model: str = 'mnl', draws: int = 1000, n_blocks: int = None, iter_lim: int = None, noimprov_lim: int = None, time_lim: int = None, seed: int = None, verbose: bool = False):
+    def optimise(self, init_design: pd.DataFrame, V: dict, model: str = 'mnl', draws: int = 1000, n_blocks: int = None, iter_lim: int = None, noimprov_lim: int = None, time_lim: int = None, batch_size: int = 1, n_restarts: int = None, n_workers: int = None, seed: int = None, verbose: bool = False):
         """Create D-efficient RUM design
 
         Starts the optimisation of the design using a random swapping 
@@ -124,17 +113,36 @@ class EffDesign:
         model : str
             The base model for the efficient design, by default 'mnl'
         draws : int, optional
-            Number of draws for the Monte Carlo integration, by default 1000
+            Number of draws for the Monte Carlo integration. The type of draws 
+            is set in `V` with `bioDraws`. Quasi-random types such as 
+            `NORMAL_MLHS` or `NORMAL_HALTON2` need fewer draws than pseudo-random 
+            ones for the same accuracy, by default 1000
         n_blocks : int, optional
             Number of blocks of the final design. Must be a multiple of the number of 
             choice situations, by default None
         iter_lim : int, optional
-            Number of iterations before the algorithm stops, by default None
+            Number of iterations before the algorithm stops. Each iteration 
+            evaluates a batch of `batch_size` swaps, by default None
         noimprov_lim : int, optional
-            Number of iterations without improvement before the algorithm 
-            stops, by default None
+            Number of consecutive iterations (batches of `batch_size` swaps) 
+            without improvement before the algorithm stops, by default None
         time_lim : int, optional
             Time (in minutes) before the algorithm stops, by default None
+        batch_size : int, optional
+            Number of random swaps evaluated together in each iteration. 
+            The swap that reduces the D-error the most is kept. Must be at 
+            least 1. Larger values reduce the overhead of each evaluation, 
+            by default 1
+        n_restarts : int, optional
+            Number of independent runs (at least 1) of the swapping algorithm 
+            from the initial design, each one in a separate process. The design with 
+            the lowest D-error is kept. On platforms that cannot fork 
+            processes (e.g., Windows), the runs are done one after another 
+            in the current process, by default None
+        n_workers : int, optional
+            Number of processes that run the restarts. If None, the number 
+            of restarts or CPUs, whichever is lower. Results do not depend 
+            on it, by default None
         seed : int, optional
             Random seed, by default None
         verbose : bool, optional
@@ -149,14 +157,24 @@ class EffDesign:
         final_perf : float
             D-error of the final design 
         final_iter : int
-            Total number of iterations
+            Total number of iterations (batches of `batch_size` swaps)
         ubalance_ratio : float
             Utility balance ratio
         """
-        # Set random seed if defined
+        # Check the batch size and number of restarts
+        if batch_size < 1:
+            raise ValueError('The batch size must be at least 1')
+
+        if n_restarts is not None and n_restarts < 1:
+            raise ValueError('The number of restarts must be at least 1')
+
+        # Set random seed if defined. Biogeme takes the draws of Bayesian models from the global NumPy random state
         if seed is not None:
             np.random.seed(seed)
 
+        # Random generator of the swapping algorithm
+        rng = np.random.default_rng(seed)
+
         # Set stopping criteria if defined
         if iter_lim is None:
             iter_lim = np.inf
@@ -176,24 +194,8 @@ class EffDesign:
 
         desmat = init_design
 
-        models_ubalance = []
-        av = dict()
-        if model == 'mnl':
-            for k, _ in V.items():
-                av[k] = 1
-            model_object = loglogit(V,av,1)
-
-            for k, _ in V.items():
-                models_ubalance.append(logit(V,av,k))
-        elif model == 'mnl_bayesian':
-            for k, _ in V.items():
-                av[k] = 1
-            model_object = log(MonteCarlo(logit(V,av,1)))
-
-            for k, _ in V.items():
-                models_ubalance.append(MonteCarlo(logit(V,av,k)))
-        else:
-            raise ValueError("""Model name must be either 'mnl' or 'mnl_bayesian'""")
+        # Build the model objects for the D-error and utility balance
+        model_object, models_ubalance = _build_models(V,model)
 
         init_perf = _derr(desmat,model_object,draws)
 
@@ -201,12 +203,17 @@ class EffDesign:
         ############## Step 2: Initialize algorighm ################
         ############################################################
 
-        # Execute Swapping algorithm
-        optimal_design, final_perf, final_iter, elapsed_time = _swapalg(
-            desmat,model_object,draws,init_perf,self.algconds,self.fixed,iter_lim,noimprov_lim,time_lim)
+        # Execute Swapping algorithm. If restarts are defined, run them in parallel with independent random generators
+        if n_restarts is None:
+            optimal_design, final_perf, final_iter, elapsed_time = _swapalg(
+                desmat,model_object,draws,init_perf,self.algconds,self.candidate_swaps,iter_lim,noimprov_lim,time_lim,rng,batch_size)
+        else:
+            seeds = np.random.SeedSequence(seed).spawn(n_restarts)
+            optimal_design, final_perf, final_iter, elapsed_time = _swapalg_restarts(
+                desmat,V,model,draws,init_perf,self.algconds,self.candidate_swaps,iter_lim,noimprov_lim,time_lim,seeds,batch_size,n_workers)
 
         # Compute utility balance ratio
-        ubalance_ratio = _utility_balance(pd.DataFrame(optimal_design,columns=self.names),models_ubalance,draws)
+        ubalance_ratio = _utility_balance(optimal_design,models_ubalance,draws)
 
         ############################################################
         ############## Step 3: Arange final design #################
@@ -219,7 +226,7 @@ class EffDesign:
         if n_blocks is not None:
             if verbose:
                 print('\nGenerating ' + str(n_blocks) + ' blocks...')
-            blocksrow = _blockgen(optimal_design,n_blocks,self.N,1000)
+            blocksrow = _blockgen(n_blocks,self.N,rng)
             optimal_design = np.c_[optimal_design,blocksrow]
 
         # Create Pandas DataFrame
@@ -255,6 +262,9 @@ class EffDesign:
             A dictionary with the utility function, using the same syntax as in Biogeme
         model : str
             The base model for the efficient design, by default 'mnl'
+        draws : int, optional
+            Number of draws for the Monte Carlo integration. The type of draws 
+            is set in `V` with `bioDraws`, by default 1000
 
         Returns
         -------
@@ -264,29 +274,10 @@ class EffDesign:
             Utility balance ratio
         """
         # Drop CS column and Block (if present) from pandas dataframe
-        desmat = design.drop('CS',axis=1)
-
-        if 'Block' in desmat.columns:
-            desmat = desmat.drop('Block',axis=1)
-
-        models_ubalance = []
-        av = dict()
-        if model == 'mnl':
-            for k, _ in V.items():
-                av[k] = 1
-            model_object = loglogit(V,av,1)
-
-            for k, _ in V.items():
-                models_ubalance.append(logit(V,av,k))
-        elif model == 'mnl_bayesian':
-            for k, _ in V.items():
-                av[k] = 1
-            model_object = log(MonteCarlo(logit(V,av,1)))
-
-            for k, _ in V.items():
-                models_ubalance.append(MonteCarlo(logit(V,av,k)))
-        else:
-            raise ValueError("""Model name must be either 'mnl' or 'mnl_bayesian'""")
+        desmat = design.drop(columns=['CS','Block'],errors='ignore')
+
+        # Build the model objects for the D-error and utility balance
+        model_object, models_ubalance = _build_models(V,model)
         
         # Evaluate the performance and utility balance of the design
         perf = _derr(desmat,model_object,draws)
@@ -1,8 +1,9 @@
 """Utilitary functions"""
 
 # Import modules
+import io
+import tokenize
 import numpy as np
-# from scipy.stats import chi2_contingency
 
 # Function for dummy generation
 def _dummygen(x,levs):
@@ -15,82 +16,55 @@ def _dummygen(x,levs):
 
     return converted_array
 
-# # Crosstab function
-# def _cross(x,y):
-#     """Create a cross tab"""
-#     tab = []
-    
-#     for i in np.unique(x):
-#         cols = []
-        
-#         for j in np.unique(y):
-#             c = np.count_nonzero((x==i) & (y==j))
-#             cols = cols + [c]
-        
-#         tab = tab + [cols]
-
-#     return np.array(tab)
-
 # Block generation function
-def _blockgen(design: np.ndarray, n_blocks: int, ncs: int, reps: int):
+def _blockgen(n_blocks: int, ncs: int, rng: np.random.Generator):
     """Blocks generator"""
-    # Create array of blocks
+    # Create array of blocks and assign them randomly to the choice situations
     blocks = np.repeat(np.arange(n_blocks)+1,int(ncs/n_blocks))
-    # bestcorr = np.inf
-    # bestblock = blocks.copy()
     
-    for _ in range(reps):
-        np.random.shuffle(blocks)
-        # blockmat = np.repeat(blocks,int(np.max(design[:,1]))).copy()
-        # sumcorr = 0
-        
-        # for a in range(2,design.shape[1]):
-        #     d = design[:,a].copy()
-        #     c = _cross(blockmat,d)
-        #     corr = chi2_contingency(c)[1]
-        #     sumcorr = sumcorr + corr
-        
-        # if sumcorr < bestcorr:
-        #     bestblock = blockmat.copy()
-        #     bestcorr = sumcorr
+    return rng.permutation(blocks)
+
+# Conjunction of condition tokens
+def _conjunction(tokens: list):
+    """Join the parts of a condition separated by '&' with a logical 'and'"""
+    # Split the tokens at the '&' operators outside parentheses
+    parts = [[]]
+    depth = 0
+
+    for t in tokens:
+        if t == '&' and depth == 0:
+            parts.append([])
+            continue
+
+        depth += (t in '([') - (t in ')]')
+        parts[-1].append(t)
 
-    # return bestblock
-    return blocks
+    # Wrap each part in parentheses, as '&' takes precedence over comparisons
+    return ' & '.join('(' + ' '.join(p) + ')' for p in parts)
 
 # Condition generation function
-def _condgen(desname: str, cond: list, names: list, init: bool = False):
+def _condgen(desname: str, cond: list, names: list):
     """Conditions generator for the design modules"""    
     # Match variable names with columns in the design matrix
-    if init:
-        design_columns = [desname + '[i,' + str(i) + ']' for i in range(len(names))]
-    else:
-        design_columns = [desname + '[:,' + str(i) + ']' for i in range(len(names))]
+    design_columns = {names[i]: desname + '[:,' + str(i) + ']' for i in range(len(names))}
 
     # Create new list of conditions
     conditions = []
 
     for c in cond:
-        # Take a copy of the string
-        cc = c[:]
-
-        # Replace names by design matrix columns
-        for i in range(len(names)):
-            cc = cc.replace(names[i],design_columns[i])
+        # Split the condition in tokens, replacing variable names by design matrix columns
+        tokens = [design_columns.get(t.string,t.string) if t.type == tokenize.NAME else t.string 
+            for t in tokenize.generate_tokens(io.StringIO(c).readline) if t.string.strip()]
         
         # If there is a conditional 'if' statement, then convert it to a logical 'or'
-        if 'if' in cc:
-            # Split the sting in the 'then' part
-            if_part, then_part = cc.split('then')
-
-            # In case there are '&' in the 'if' 'then' part, convert them to '*'
-            if_part = if_part.replace('&','*')
-            then_part = then_part.replace('&','*')
-
-            # Set the 'logical_not' operator in the 'if' part
-            if_part = 'np.logical_not(' + if_part.replace('if','') + ')'
-
-            # Merge if and then parts
-            cc = 'np.logical_or(' + if_part + ',' + then_part + ')'
+        if tokens[0] == 'if':
+            # Split the tokens in the 'then' part
+            then = tokens.index('then')
+
+            # Set the 'logical_not' operator in the 'if' part and merge if and then parts
+            cc = 'np.logical_or(np.logical_not(' + _conjunction(tokens[1:then]) + '),' + _conjunction(tokens[then+1:]) + ')'
+        else:
+            cc = _conjunction(tokens)
         
         # Finally, append condition to condition list
         conditions.append(cc)
@@ -99,51 +73,39 @@ def _condgen(desname: str, cond: list, names: list, init: bool = False):
     return conditions
 
 # Generate initial design matrix
-def _initdesign(levs: list, ncs: int, cond: list):
+def _initdesign(levs: list, ncs: int, cond: list, rng: np.random.Generator):
     """Generate initial design matrix"""
-    # Create and populate the initial design matrix
-    desmat = []
+    # Create and populate the initial design matrix, repeating the levels of each attribute
+    desmat = np.empty((ncs,len(levs)),dtype=np.result_type(*[np.asarray(l).dtype for l in levs]))
 
-    # for k in levs:
     for k in range(len(levs)):
-        col = np.array((levs[k] * int(np.ceil(ncs/len(levs[k]))))[:ncs])
-        np.random.shuffle(col)
-        desmat.append(col)
+        reps = -(-ncs // len(levs[k]))
+        desmat[:,k] = np.tile(np.asarray(levs[k]),reps)[:ncs]
     
-    desmat = np.array(desmat).T
+    # Shuffle each column independently
+    desmat = rng.permuted(desmat,axis=0)
 
     # Apply conditions if needed
     if cond is not None:
-        for i in range(ncs):
-            # Check if all conditions are satisfied. If not, do a big enough loop till all conditions are satisfied
-            check_all = []
-
-            for c in cond:
-                check_all.append(eval(c))
+        # Compile all conditions once into a single predicate over the rows of a design matrix
+        check = eval(compile('lambda desmat: ' + ' & '.join('(' + c + ')' for c in cond),'<cond>','eval'),{'np': np})
 
-            check_all = np.all(check_all)
+        # Find the rows that do not satisfy all conditions
+        bad = np.flatnonzero(~np.broadcast_to(check(desmat),ncs))
 
-            if not check_all:
-                for _ in range(10000):
-                    # Create a random vector of levels for the row in question
-                    for k in range(len(levs)):
-                        desmat[i,k] = np.random.choice(levs[k])
-                    
-                    # Check if conditions are met with the new vector in the design.
-                    check_all = []
+        # Redraw the levels of these rows at once, till all conditions are satisfied or a big enough number of attempts
+        for _ in range(10000):
+            if bad.size == 0:
+                break
 
-                    for c in cond:
-                        check_all.append(eval(c))
-
-                    check_all = np.all(check_all)
-
-
-                    # If so, break the loop and go for the next row
-                    if check_all:
-                        break
+            for k in range(len(levs)):
+                desmat[bad,k] = rng.choice(levs[k],size=bad.size)
+            
+            # Keep the rows that still do not satisfy the conditions
+            bad = bad[~np.broadcast_to(check(desmat[bad]),bad.size)]
             
-            # If after the big loop conditions are not met, then raise an error
-            assert check_all, 'It is not possible to met all conditions in the initial design matrix.'
+        # If after the big loop conditions are not met, then raise an error
+        assert bad.size == 0, 'It is not possible to met all conditions in the initial design matrix.'
     
     # Return the design matrix
     return desmat
\ No newline at end of file
@@ -4,8 +4,6 @@
 # https://www.sphinx-doc.org/en/master/usage/configuration.html
 
 import os
-import sys
-sys.path.insert(0, os.path.abspath(".."))
 
 # -- Project information -----------------------------------------------------
 # https://www.sphinx-doc.org/en/master/usage/configuration.html#project-information
@@ -19,20 +17,27 @@ release = 'latest'
 # https://www.sphinx-doc.org/en/master/usage/configuration.html#general-configuration
 
 extensions = [
-    'sphinx.ext.autodoc',
-    'sphinx.ext.autosummary',
+    'autoapi.extension',
     'sphinx_rtd_theme',
     'sphinx.ext.napoleon']
 
-autodoc_default_options = {
-    'members': True,
-    'inherited-members': True
-}
-autosummary_generate = True
-numpydoc_show_class_members = False
+# API reference is generated from the source files, without importing the package
+autoapi_type = 'python'
+autoapi_dirs = ['../choicedesign']
+autoapi_options = ['members', 'undoc-members', 'show-inheritance']
+autoapi_keep_files = False
+
+# Keep signatures short, parameter types are given in the docstrings
+autodoc_typehints = 'description'
+python_use_unqualified_type_names = True
 
-templates_path = ['_templates']
-exclude_patterns = ['_build', 'Thumbs.db', '.DS_Store']
+# Docstrings follow the NumPy style only
+napoleon_google_docstring = False
+napoleon_numpy_docstring = True
+
+templates_path = ['_templates'] if os.path.isdir(os.path.join(os.path.dirname(__file__),'_templates')) else []
+exclude_patterns = ['_build', 'Thumbs.db', '.DS_Store', '**/__pycache__', '.venv', 'venv']
+source_suffix = {'.rst': 'restructuredtext'}
 
 master_doc = 'index'
 
@@ -40,7 +45,11 @@ master_doc = 'index'
 # https://www.sphinx-doc.org/en/master/usage/configuration.html#options-for-html-output
 
 html_theme = 'sphinx_rtd_theme'
-html_static_path = ['_static']
+html_static_path = ['_static'] if os.path.isdir(os.path.join(os.path.dirname(__file__),'_static')) else []
+
+# Do not copy the reST sources to the output
+html_copy_source = False
+html_show_sourcelink = False
 
 # -- Options for LaTeX output ---------------------------------------------
 
@@ -7,8 +7,13 @@ REM Command file for Sphinx documentation
 if "%SPHINXBUILD%" == "" (
 	set SPHINXBUILD=sphinx-build
 )
+if "%SPHINXOPTS%" == "" (
+	set SPHINXOPTS=-j auto
+)
 set SOURCEDIR=.
-set BUILDDIR=_build
+if "%BUILDDIR%" == "" (
+	set BUILDDIR=_build
+)
 
 %SPHINXBUILD% >NUL 2>NUL
 if errorlevel 9009 (
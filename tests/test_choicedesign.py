@@ -1,5 +1,156 @@
-from choicedesign import __version__
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pytest
+from biogeme.expressions import Beta, Variable, bioDraws
+from biogeme.models import loglogit
+
+from choicedesign import __version__, algorithms
+from choicedesign.algorithms import _swapalg
+from choicedesign.design import EffDesign
+from choicedesign.criteria import _derr, _derr_imat, _imat, _logdet
+from choicedesign.utils import _condgen, _initdesign
+
+
+def _mnl_example(ncs=12, seed=0):
+    names = ['alt1_A', 'alt1_B', 'alt2_A', 'alt2_B']
+    rng = np.random.default_rng(seed)
+    design = pd.DataFrame(rng.integers(0, 3, (ncs, len(names))).astype(float), columns=names)
+    beta_A = Beta('beta_A', -0.1, None, None, 0)
+    beta_B = Beta('beta_B', 0.2, None, None, 0)
+    V = {
+        1: beta_A * Variable('alt1_A') + beta_B * Variable('alt1_B'),
+        2: beta_A * Variable('alt2_A') + beta_B * Variable('alt2_B')}
+    return design, loglogit(V, {1: 1, 2: 1}, 1)
+
+
+def _bayes_example(ncs=16):
+    # Attributes and priors of examples/d_efficient_rum_bayes.ipynb
+    atts = [
+        {'name': name, 'levels': levels, 'avail': ['alt1', 'alt2'], 'fixed': None}
+        for name, levels in [('A', [1, 2, 3]), ('B', [10, 15, 15.5]), ('C', [0, 3, 5]), ('D', [0, 1, 2])]]
+    beta_A = Beta('beta_A', -0.1, None, None, 0) + Beta('sd_A', 0.01, None, None, 0) * bioDraws('beta_A_rnd', 'NORMAL_MLHS')
+    beta_B = Beta('beta_B', -0.2, None, None, 0) + Beta('sd_B', 0.03, None, None, 0) * bioDraws('beta_B_rnd', 'UNIFORM_MLHS')
+    beta_C = Beta('beta_C', 0.1, None, None, 0)
+    beta_D = Beta('beta_D', 0.15, None, None, 0)
+    V = {
+        j + 1: beta_A * Variable(a + '_A') + beta_B * Variable(a + '_B') + beta_C * Variable(a + '_C') + beta_D * Variable(a + '_D')
+        for j, a in enumerate(['alt1', 'alt2'])}
+    return EffDesign(atts, ['alt1', 'alt2'], ncs), V
 
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+def test_imat_contributions():
+    design, model = _mnl_example()
+    im = _imat(design, model, 10)
+    im_cs = _imat(design, model, 10, aggregation=False)
+    assert im_cs.shape == (len(design), 2, 2)
+    assert np.allclose(im_cs.sum(axis=0), im)
+    assert np.isclose(_derr_imat(im), _derr(design, model, 10))
+
+
+def test_derr_indefinite():
+    # Indefinite matrices with a positive determinant have a finite D-error
+    im = np.diag([2., -1., -3.])
+    assert np.isclose(_derr_imat(im), 6 ** (-1 / 3))
+    assert _derr_imat(np.diag([2., -1., 3.])) == np.inf
+
+
+def test_optimise_bayesian():
+    design, V = _bayes_example()
+    init_design = design.gen_initdesign(seed=0)
+    _, init_perf, final_perf, _, _ = design.optimise(
+        init_design, V, model='mnl_bayesian', draws=20, iter_lim=30, batch_size=4, seed=0)
+    assert np.isfinite(init_perf)
+    assert final_perf < init_perf
+
+    with pytest.raises(ValueError):
+        design.optimise(init_design, V, model='mnl_bayesian', draws=20, iter_lim=30, batch_size=0)
+
+
+def test_logdet_stack():
+    design, model = _mnl_example()
+    im_cs = _imat(design, model, 10, aggregation=False)
+    ims = np.stack([im_cs[2:].sum(axis=0), im_cs.sum(axis=0), -im_cs.sum(axis=0), np.diag([2., -1., -3.])[:2, :2]])
+    log_dets = _logdet(ims)
+    assert np.allclose(log_dets[:2], np.linalg.slogdet(ims[:2])[1])
+    assert np.isclose(log_dets[2], np.linalg.slogdet(ims[2])[1])
+    assert log_dets[3] == -np.inf
+    assert np.isclose(np.exp(-log_dets[1] / 2), _derr_imat(ims[1]))
+
+
+def test_swapalg_batch():
+    design, model = _mnl_example()
+    init_perf = _derr(design, model, 10)
+    candidate_swaps = [np.arange(len(design))] * design.shape[1]
+    final_design, final_perf, _, _ = _swapalg(
+        design, model, 10, init_perf, None, candidate_swaps, 50, np.inf, np.inf,
+        np.random.default_rng(0), batch_size=8)
+    assert final_perf <= init_perf
+    assert np.isclose(final_perf, _derr(final_design, model, 10))
+    assert np.all(np.sort(final_design.to_numpy(), axis=0) == np.sort(design.to_numpy(), axis=0))
+
+
+def test_gen_initdesign_fixed():
+    atts = [
+        {'name': 'A', 'levels': [1, 2, 3], 'avail': ['alt1', 'alt2'], 'fixed': None},
+        {'name': 'B', 'levels': [4, 5], 'avail': ['alt2'], 'fixed': [0, 1]},
+    ]
+    design = EffDesign(atts, ['alt1', 'alt2'], 6)
+    assert design.names == ['alt1_A', 'alt2_A', 'alt2_B']
+    assert design.fixed == [None, None, [0, 1]]
+
+    init_design = design.gen_initdesign(seed=0).to_numpy()
+    assert np.all(np.isin(init_design[:, :2], [1, 2, 3]))
+    assert np.all(init_design[[0, 1], 2] == 0)
+    assert np.all(np.isin(init_design[2:, 2], [4, 5]))
+
+
+def test_condgen():
+    names = ['price', 'price2', 'time']
+    conditions = _condgen('desmat', ['price > price2', 'if time > 1 then price < 3 & price2 < 2'], names)
+    desmat = np.array([[2, 1, 2], [3, 1, 0], [2, 1, 2], [4, 3, 2]])
+    checks = [eval(c, {'np': np, 'desmat': desmat}) for c in conditions]
+    assert np.array_equal(checks[0], [True, True, True, True])
+    assert np.array_equal(checks[1], [True, True, True, False])
+
+    init_design = _initdesign([[1, 2, 3], [1, 2, 3], [0, 1, 2]], 30, conditions, np.random.default_rng(0))
+    assert np.all(init_design[:, 0] > init_design[:, 1])
+    assert np.all((init_design[:, 2] <= 1) | ((init_design[:, 0] < 3) & (init_design[:, 1] < 2)))
+
+
+def test_optimise_restarts():
+    design, V = _bayes_example()
+    init_design = design.gen_initdesign(seed=0)
+    optimal_design, init_perf, final_perf, _, _ = design.optimise(
+        init_design, V, model='mnl_bayesian', draws=20, iter_lim=20, batch_size=4, n_restarts=2, seed=0)
+    assert final_perf <= init_perf
+    assert np.all(np.sort(optimal_design[design.names].to_numpy(), axis=0) == np.sort(init_design.to_numpy(), axis=0))
+
+
+def test_optimise_restarts_workers():
+    design, V = _bayes_example()
+    init_design = design.gen_initdesign(seed=0)
+    results = [
+        design.optimise(init_design, V, model='mnl_bayesian', draws=20, iter_lim=20, batch_size=4, n_restarts=3, n_workers=n_workers, seed=1)
+        for n_workers in [1, 2]]
+    assert results[0][0].equals(results[1][0])
+    assert results[0][2] == results[1][2]
+
+    with pytest.raises(ValueError):
+        design.optimise(init_design, V, model='mnl_bayesian', draws=20, iter_lim=20, n_restarts=0)
+
+
+def test_optimise_restarts_nofork(monkeypatch):
+    design, V = _bayes_example()
+    init_design = design.gen_initdesign(seed=0)
+    kwargs = dict(model='mnl_bayesian', draws=20, iter_lim=20, batch_size=4, n_restarts=2, seed=1)
+    forked = design.optimise(init_design, V, **kwargs)
+    monkeypatch.setattr(multiprocessing, 'get_all_start_methods', lambda: ['spawn'])
+    inprocess = design.optimise(init_design, V, **kwargs)
+    assert forked[0].equals(inprocess[0])
+    assert algorithms._restart_V is None